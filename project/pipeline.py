@@ -1,10 +1,20 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import zipfile
 import sqlite3
-import io
-from sqlalchemy import create_engine
+import shutil
+import tempfile
+import time
+import threading
 import logging
 from concurrent.futures import ThreadPoolExecutor
 
@@ -17,22 +27,138 @@ COLLISION_URL = os.getenv("COLLISION_URL", "https://data.cityofnewyork.us/resour
 POPULATION_URL = os.getenv("POPULATION_URL", "https://data.cityofnewyork.us/resource/xi7c-iiu2.csv")
 STREET_ZIP_URL = "https://data.cityofnewyork.us/download/w4v2-rv6b/application%2Fzip"
 STREET_FILENAME = "bobaadr.txt"
+STREET_MAPPING_MAX_AGE = 7 * 24 * 60 * 60  # seconds
+RAW_DATA_MAX_AGE = 24 * 60 * 60  # seconds; the collisions feed is updated daily
+FORCE_DOWNLOAD = os.getenv("FORCE_DOWNLOAD") == "1"  # bypass all on-disk caches
+
+# Fixed borough categories, so borough group-bys and joins work on small integer codes
+BOROUGHS = ["Unknown", "Manhattan", "Bronx", "Brooklyn", "Queens", "Staten Island"]
+BOROUGH_DTYPE = pd.CategoricalDtype(BOROUGHS)
+
+# Columns each cleaner actually reads from the raw datasets
+COLLISION_COLUMNS = [
+    "collision_id", "crash_date", "borough", "on_street_name", "off_street_name", "cross_street_name",
+    "vehicle_type_code1",
+    "number_of_persons_injured", "number_of_persons_killed",
+    "number_of_pedestrians_injured", "number_of_pedestrians_killed",
+    "number_of_cyclist_injured", "number_of_cyclist_killed",
+    "number_of_motorist_injured", "number_of_motorist_killed",
+]
+POPULATION_COLUMNS = ["borough", "_2010_population"]
+
+# Dates and casualty counts are read as plain strings, so a malformed value anywhere in
+# the file cannot abort the parse; the cleaner coerces them and drops or zeroes bad values.
+# Repeated strings are dictionary-encoded by the reader and arrive as pandas categoricals
+COLLISION_TYPES = {
+    "crash_date": pa.string(),
+    **{col: pa.string() for col in COLLISION_COLUMNS if col.startswith("number_of_")},
+    **{
+        col: pa.dictionary(pa.int32(), pa.string())
+        for col in ["borough", "on_street_name", "off_street_name", "cross_street_name", "vehicle_type_code1"]
+    },
+}
+
+# Arrow integer columns become nullable pandas integers instead of being upcast to float on nulls
+NULLABLE_INT_TYPES = {pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype()}
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
 
-def download_data(url, save_path):
+# Paths of every file the pipeline reads or writes, resolved once
+RAW_COLLISIONS_PATH = os.path.join(DATA_DIR, "raw_collisions.csv")
+RAW_POPULATION_PATH = os.path.join(DATA_DIR, "raw_population.csv")
+STREET_TXT_PATH = os.path.join(DATA_DIR, STREET_FILENAME)
+STREET_MAPPING_CACHE = os.path.join(DATA_DIR, "street_mapping.feather")
+COLLISIONS_DB_PATH = os.path.join(DATA_DIR, "collisions.db")
+POPULATION_DB_PATH = os.path.join(DATA_DIR, "population.db")
+COMBINED_DB_PATH = os.path.join(DATA_DIR, "combined_data.db")
+COLLISIONS_FEATHER_PATH = os.path.join(DATA_DIR, "collisions.feather")
+POPULATION_FEATHER_PATH = os.path.join(DATA_DIR, "population.feather")
+
+# Shared keep-alive session: one pooled connection per concurrent download, and transient
+# failures retried with backoff
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=3, pool_maxsize=3,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504)),
+))
+
+def is_cache_usable(path, max_age=None):
     """
-    Downloads a CSV file from the given URL and saves it to the specified path.
+    Tells whether a cached file can be reused instead of downloading it again.
+    Setting FORCE_DOWNLOAD=1 bypasses every cache.
     """
+    if FORCE_DOWNLOAD or not os.path.exists(path):
+        return False
+    return max_age is None or time.time() - os.path.getmtime(path) < max_age
+
+
+# Background Parquet cache writes started by download_data; main() waits for them
+CACHE_WRITERS = []
+
+
+def raw_cache_path(save_path):
+    """
+    Path of the Parquet cache download_data keeps for a raw CSV download.
+    """
+    return os.path.splitext(save_path)[0] + ".parquet"
+
+
+def write_parquet_cache(table, cache_path):
+    """
+    Writes an Arrow table to the Parquet cache. The file is written under a temporary
+    name and renamed, so an interrupted write never leaves a truncated cache behind.
+    """
+    tmp_path = cache_path + ".tmp"
+    try:
+        pq.write_table(table, tmp_path, compression="zstd", row_group_size=64 * 1024)
+        os.replace(tmp_path, cache_path)
+        logging.info(f"Saved raw data to {cache_path}")
+    except Exception as e:
+        logging.error(f"Failed to write cache {cache_path}: {e}")
+
+
+def download_data(url, save_path, columns=None, column_types=None):
+    """
+    Streams a CSV file from the given URL straight into the Arrow CSV reader and
+    caches the parsed table as Parquet next to the specified path.
+    Only the requested columns are parsed and cached; later runs load them from the
+    cache while it is younger than RAW_DATA_MAX_AGE, was downloaded from the same URL
+    and holds every requested column.
+    """
+    cache_path = raw_cache_path(save_path)
     try:
+        if is_cache_usable(cache_path, max_age=RAW_DATA_MAX_AGE):
+            schema = pq.read_schema(cache_path)
+            cache_matches = (
+                (schema.metadata or {}).get(b"source_url") == url.encode()
+                and set(columns or []).issubset(schema.names)
+            )
+        else:
+            cache_matches = False
+        if cache_matches:
+            logging.info(f"Loading cached data from {cache_path}...")
+            table = pq.read_table(cache_path, columns=columns)
+            return table.to_pandas(self_destruct=True, types_mapper=NULLABLE_INT_TYPES.get)
+
         logging.info(f"Downloading data from {url}...")
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        with open(save_path, "wb") as file:
-            file.write(response.content)
-        logging.info(f"Saved raw data to {save_path}")
-        return pd.read_csv(save_path)
+        with SESSION.get(url, stream=True, timeout=10) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            table = pv.read_csv(
+                response.raw,
+                read_options=pv.ReadOptions(use_threads=True, block_size=8 << 20),
+                convert_options=pv.ConvertOptions(
+                    include_columns=columns or [], column_types=column_types, strings_can_be_null=True
+                ),
+            )
+        # Record where the data came from, so a cache from a different URL is never reused
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"source_url": url.encode()})
+        # Write the cache in the background; the parsed table is handed back straight away
+        writer = threading.Thread(target=write_parquet_cache, args=(table, cache_path))
+        writer.start()
+        CACHE_WRITERS.append(writer)
+        return table.to_pandas(types_mapper=NULLABLE_INT_TYPES.get)
     except Exception as e:
         logging.error(f"Failed to download data from {url}: {e}")
         raise
@@ -42,101 +168,181 @@ def download_and_extract_zip(zip_url, extract_filename, save_path):
     """
     Downloads a ZIP file, extracts a specific file, and saves it to the specified path.
     Handles nested directory structures within the ZIP file.
+    Skips the download when a recently extracted file is already present. An older
+    extracted file is revalidated with the ETag of the archive it came from, and kept
+    when the server reports it unchanged.
     """
+    if is_cache_usable(save_path, max_age=STREET_MAPPING_MAX_AGE):
+        logging.info(f"Using previously extracted {save_path}")
+        return save_path
+    etag_path = save_path + ".etag"
+    headers = {}
+    if is_cache_usable(save_path) and os.path.exists(etag_path):
+        with open(etag_path) as f:
+            headers["If-None-Match"] = f.read().strip()
     try:
         logging.info(f"Downloading ZIP file from {zip_url}...")
-        response = requests.get(zip_url, timeout=10)
-        response.raise_for_status()
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
-            # Look for the target file in the ZIP archive
-            target_file = None
-            for file_name in zf.namelist():
-                if file_name.endswith(extract_filename):
-                    target_file = file_name
-                    break
-
-            if not target_file:
-                raise FileNotFoundError(f"{extract_filename} not found in the ZIP archive.")
-
-            # Extract and save the file
-            with zf.open(target_file) as file:
-                with open(save_path, "wb") as output_file:
-                    output_file.write(file.read())
-        logging.info(f"Extracted {target_file} to {save_path}")
+        # Stream the archive into a spooled temp file (spills to disk past 64 MiB)
+        # instead of holding the whole body in memory
+        with SESSION.get(zip_url, headers=headers, stream=True, timeout=10) as response, \
+                tempfile.SpooledTemporaryFile(max_size=64 << 20) as archive:
+            if response.status_code == 304:
+                # Unchanged upstream: keep the extracted file and restart its max-age window
+                logging.info(f"{zip_url} not modified, keeping {save_path}")
+                os.utime(save_path)
+                return save_path
+            response.raise_for_status()
+            etag = response.headers.get("ETag")
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, archive, 1 << 20)
+            archive.seek(0)
+
+            with zipfile.ZipFile(archive) as zf:
+                # Look for the target file in the ZIP archive's central directory
+                target_file = next(
+                    (info for info in zf.infolist() if info.filename.endswith(extract_filename)), None
+                )
+                if target_file is None:
+                    raise FileNotFoundError(f"{extract_filename} not found in the ZIP archive.")
+
+                # Extract the file in 1 MiB chunks under a temporary name, then rename it,
+                # so an interrupted extraction never looks like a fresh, complete file
+                tmp_path = save_path + ".tmp"
+                with zf.open(target_file) as file, open(tmp_path, "wb") as output_file:
+                    shutil.copyfileobj(file, output_file, 1 << 20)
+                os.replace(tmp_path, save_path)
+        # Remember the archive's validator for the next revalidation (or forget a stale one)
+        if etag:
+            with open(etag_path + ".tmp", "w") as f:
+                f.write(etag)
+            os.replace(etag_path + ".tmp", etag_path)
+        elif os.path.exists(etag_path):
+            os.remove(etag_path)
+        logging.info(f"Extracted {target_file.filename} to {save_path}")
+        return save_path
     except Exception as e:
         logging.error(f"Failed to download or extract {extract_filename}: {e}")
         raise
 
 
-def save_to_sqlite(dataframe, database_path, table_name):
+def save_to_sqlite(dataframe, database_path, table_name, chunk_size=10_000):
     """
-    Saves a DataFrame to an SQLite database.
+    Bulk-loads a DataFrame into an SQLite database, replacing the table if it exists.
+    Rows are inserted in chunks inside a single transaction with journaling and syncing disabled.
     """
     try:
         logging.info(f"Saving data to SQLite database: {database_path} (table: {table_name})...")
-        engine = create_engine(f"sqlite:///{database_path}")
-        dataframe.to_sql(table_name, engine, if_exists="replace", index=False)
+        conn = sqlite3.connect(database_path, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            # 256 MiB page cache (negative values are KiB) so the load rarely spills pages early
+            conn.execute("PRAGMA cache_size=-262144")
+            conn.execute("BEGIN")
+            conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            conn.execute(pd.io.sql.get_schema(dataframe, table_name))
+
+            insert_sql = f'INSERT INTO "{table_name}" VALUES ({", ".join("?" * len(dataframe.columns))})'
+            # Hand each chunk over column-wise: tolist() converts a whole column in C
+            for start in range(0, len(dataframe), chunk_size):
+                chunk = dataframe.iloc[start:start + chunk_size]
+                conn.executemany(insert_sql, zip(*(chunk[col].tolist() for col in chunk.columns)))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
         logging.info("Data saved successfully.")
     except Exception as e:
         logging.error(f"Error saving data to SQLite: {e}")
         raise
 
 
-def clean_collisions_data(data):
+def save_to_feather(dataframe, feather_path):
     """
-    Cleans the Motor Vehicle Collisions dataset.
+    Saves a DataFrame as a ZSTD-compressed Arrow IPC (Feather) file for columnar consumers.
+    Categorical columns are stored dictionary-encoded.
     """
-    logging.info("Cleaning collisions data...")
+    try:
+        logging.info(f"Saving data to Feather file: {feather_path}...")
+        table = pa.Table.from_pandas(dataframe, preserve_index=False)
+        feather.write_feather(table, feather_path, compression="zstd")
+        logging.info("Data saved successfully.")
+    except Exception as e:
+        logging.error(f"Error saving data to Feather: {e}")
+        raise
 
-    # Drop duplicate rows
-    data = data.drop_duplicates()
 
-    # Handle missing borough data
-    data['borough'] = data['borough'].fillna("Unknown")
+def encode_categories(data, columns):
+    """
+    Converts repeated string columns to the pandas 'category' dtype (dictionary encoding).
+    Missing columns are skipped.
+    """
+    for col in columns:
+        if col in data.columns:
+            data[col] = data[col].astype('category')
+    return data
 
-    # Convert borough names to title case
-    data['borough'] = data['borough'].str.title()
 
-    # Convert date columns to datetime
-    data['crash_date'] = pd.to_datetime(data['crash_date'], errors='coerce')
-    data['crash_time'] = pd.to_datetime(data['crash_time'], format='%H:%M', errors='coerce').dt.time
+def encode_collision_boroughs(boroughs):
+    """
+    Strips and title-cases collision borough names and encodes them as BOROUGH_DTYPE.
+    Missing names and names outside BOROUGHS become 'Unknown'; the latter are logged.
+    """
+    names = boroughs.str.strip().str.title()
+    encoded = names.astype(BOROUGH_DTYPE)
+    unmatched = names.notna() & encoded.isna()
+    if unmatched.any():
+        logging.warning(
+            f"Treating {unmatched.sum()} collision rows with unrecognized boroughs as 'Unknown': "
+            f"{sorted(names[unmatched].unique())}")
+    return encoded.fillna("Unknown")
 
-    # Filter out rows with invalid dates
-    data = data.dropna(subset=['crash_date'])
 
-    # Drop unwanted columns
-    columns_to_drop = [
-                          'crash_date', 'crash_time', 'latitude', 'longitude', 'location', 'collision_id'
-                      ] + [col for col in data.columns if "vehicle" in col and col != "vehicle_type_code1"]
-    data = data.drop(columns=columns_to_drop, errors='ignore')
-
-    # Rename 'vehicle_type_code1' to 'vehicle_type'
-    if 'vehicle_type_code1' in data.columns:
-        data.rename(columns={'vehicle_type_code1': 'vehicle_type'}, inplace=True)
+def clean_collisions_data(data):
+    """
+    Cleans the Motor Vehicle Collisions dataset.
+    """
+    logging.info("Cleaning collisions data...")
 
-    # Identify fatality-related columns dynamically
+    # Identify fatality- and injury-related columns dynamically
     fatality_columns = [col for col in data.columns if 'killed' in col.lower()]
     if not fatality_columns:
         raise KeyError("No columns with 'killed' found in the dataset.")
-
-    # Convert fatality columns to numeric and handle missing values
-    for col in fatality_columns:
-        data[col] = pd.to_numeric(data[col], errors='coerce').fillna(0).astype(int)
-
-    # Create a new column for total injuries
-    data['total_fatalities'] = data[fatality_columns].sum(axis=1)
-
-    # Identify injury-related columns dynamically
     injury_columns = [col for col in data.columns if 'injured' in col.lower()]
     if not injury_columns:
         raise KeyError("No columns with 'injured' found in the dataset.")
 
-    # Convert injury columns to numeric and handle missing values
-    for col in injury_columns:
-        data[col] = pd.to_numeric(data[col], errors='coerce').fillna(0).astype(int)
+    # Duplicates are identified by the natural key when it is available
+    key_columns = ['collision_id'] if 'collision_id' in data.columns else None
+
+    # Unwanted columns
+    columns_to_drop = [
+                          'crash_date', 'crash_time', 'latitude', 'longitude', 'location', 'collision_id'
+                      ] + [col for col in data.columns if "vehicle" in col and col != "vehicle_type_code1"]
 
-    # Create a new column for total injuries
-    data['total_injuries'] = data[injury_columns].sum(axis=1)
+    # One method chain, so no intermediate frame is kept alive between steps
+    data = (
+        data.drop_duplicates(subset=key_columns, keep='first')
+        # Filter out rows with invalid dates; the dates themselves are dropped, so only the mask is kept
+        .loc[lambda d: pd.to_datetime(d['crash_date'], format='ISO8601', errors='coerce').notna()]
+        .drop(columns=columns_to_drop, errors='ignore')
+        .rename(columns={'vehicle_type_code1': 'vehicle_type'})
+        # Normalize borough names only once rows and columns have been pruned, and encode
+        # them right away so detection and the later group-bys work on category codes
+        .assign(borough=lambda d: encode_collision_boroughs(d['borough']))
+    )
+
+    # Casualty columns arrive as strings; non-numeric and missing counts become 0. Each block
+    # is extracted once as a contiguous int32 array, then reused for its row-sum.
+    fatalities = data[fatality_columns].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=np.int32)
+    injuries = data[injury_columns].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=np.int32)
+    data[fatality_columns] = fatalities
+    data[injury_columns] = injuries
+    data['total_fatalities'] = fatalities.sum(axis=1, dtype=np.int32)
+    data['total_injuries'] = injuries.sum(axis=1, dtype=np.int32)
+
+    # Dictionary-encode the repeated string columns
+    data = encode_categories(data, ['vehicle_type', 'on_street_name', 'off_street_name', 'cross_street_name'])
 
     logging.info("Collisions data cleaned.")
     return data
@@ -146,41 +352,82 @@ def clean_population_data(data):
     Cleans the Population by Community District dataset, focusing on the 2010 population column.
     """
     logging.info("Cleaning population data...")
-    data.columns = data.columns.str.lower().str.strip()
-    # Convert borough names to title case
-    data['borough'] = data['borough'].str.title()
-    if '_2010_population' not in data.columns:
+    columns = data.columns.str.lower().str.strip()
+    if '_2010_population' not in columns:
         raise KeyError("'_2010_population' column is missing in the dataset.")
-    data.rename(columns={'_2010_population': 'population'}, inplace=True)
-    # Ensure the population column is numeric
-    data['population'] = pd.to_numeric(data['population'], errors='coerce').fillna(0).astype(int)
-    # Group by borough and aggregate population
-    if 'borough' in data.columns:
-        data = data.groupby('borough', as_index=False)['population'].sum()
-    else:
+    if 'borough' not in columns:
         raise KeyError("'borough' column is missing in the dataset. Cannot aggregate by borough.")
-    # Rename the aggregated column to 'total_population' for clarity
-    data.rename(columns={'population': 'total_population'}, inplace=True)
-    # Add a default row for 'Unknown'
-    if 'Unknown' not in data['borough'].values:
-        data = pd.concat([data, pd.DataFrame([{'borough': 'Unknown', 'total_population': 0}])], ignore_index=True)
+    data = data.set_axis(columns, axis=1)
+
+    # Borough codes from stripped, title-cased names; numeric population values (missing as 0)
+    boroughs = data['borough'].str.strip().str.title()
+    codes = boroughs.astype(BOROUGH_DTYPE).cat.codes.to_numpy()
+    population = pd.to_numeric(data['_2010_population'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+
+    # Names outside BOROUGHS (code -1) cannot be aggregated; report what is left out
+    known = codes >= 0
+    if not known.all():
+        unmatched = sorted(boroughs[~known].fillna("<missing>").unique())
+        logging.warning(
+            f"Dropping {(~known).sum()} population rows ({population[~known].sum()} people) "
+            f"with unrecognized boroughs: {unmatched}")
+
+    # Aggregate population per borough code in one bincount pass; every borough
+    # (including the default 'Unknown' row) gets an entry, unobserved ones with 0
+    totals = np.bincount(codes[known], weights=population[known], minlength=len(BOROUGHS))
+    data = pd.DataFrame({
+        'borough': pd.Series(BOROUGHS, dtype=BOROUGH_DTYPE),
+        'total_population': totals.astype(np.int64),
+    })
     logging.info("Population data aggregated by borough.")
     return data
 
 def preprocess_street_mapping(txt_path):
     """
     Reads and preprocesses the street mapping file (bobaadr.txt).
-    Standardizes street names and creates a mapping dictionary.
+    Standardizes street names and creates a mapping Series indexed by street name.
     """
     logging.info("Preprocessing street mapping...")
-    street_data = pd.read_csv(txt_path, delimiter=",", dtype=str)
+    table = pv.read_csv(txt_path, convert_options=pv.ConvertOptions(
+        include_columns=['stname', 'boro'],
+        column_types={'stname': pa.string(), 'boro': pa.string()},
+        strings_can_be_null=True,
+    ))
+
+    # Standardize street names and boro codes with Arrow string kernels, before any
+    # Python string objects are created
+    street_data = pd.DataFrame({
+        'stname': pc.utf8_upper(pc.utf8_trim_whitespace(table['stname'])).to_pandas(),
+        'boro': pc.utf8_trim_whitespace(table['boro']).to_pandas(),
+    })
 
-    # Standardize street names and boro codes
-    street_data['stname'] = street_data['stname'].str.strip().str.upper()
-    street_data['boro'] = street_data['boro'].str.strip()
+    # One entry per street name; the last occurrence wins, as it would in a dict
+    street_data = street_data.dropna(subset=['stname']).drop_duplicates('stname', keep='last')
 
-    # Create mapping dictionary: {street_name: boro_code}
-    return dict(zip(street_data['stname'], street_data['boro']))
+    # Create mapping Series: street_name -> boro_code
+    return pd.Series(street_data['boro'].values, index=street_data['stname'].values)
+
+
+def load_street_mapping():
+    """
+    Returns the street-to-boro mapping, building it from the street ZIP file only when
+    the Feather cache in DATA_DIR is missing or older than STREET_MAPPING_MAX_AGE.
+    """
+    cache_path = STREET_MAPPING_CACHE
+    if is_cache_usable(cache_path, max_age=STREET_MAPPING_MAX_AGE):
+        logging.info(f"Loading cached street mapping from {cache_path}...")
+        cached = pd.read_feather(cache_path)
+        return pd.Series(cached['boro'].values, index=cached['street_name'].values)
+
+    street_txt_path = download_and_extract_zip(STREET_ZIP_URL, STREET_FILENAME, STREET_TXT_PATH)
+    street_mapping = preprocess_street_mapping(street_txt_path)
+    # Written under a temporary name and renamed, so an interrupted run never leaves a
+    # truncated cache that would be trusted for STREET_MAPPING_MAX_AGE
+    tmp_path = cache_path + ".tmp"
+    pd.DataFrame({'street_name': street_mapping.index, 'boro': street_mapping.values}).to_feather(tmp_path)
+    os.replace(tmp_path, cache_path)
+    logging.info(f"Saved street mapping to {cache_path}")
+    return street_mapping
 
 
 def integrate_street_names(data, street_mapping):
@@ -202,38 +449,31 @@ def integrate_street_names(data, street_mapping):
         "5": "Staten Island"
     }
 
-    # Filter rows with 'Unknown' borough
-    unknown_boroughs = data[data['borough'] == "Unknown"].copy()
+    # Resolve boro codes to borough names once; street names are already standardized
+    boroughs = street_mapping.map(borocode_to_borough).fillna("Unknown").to_numpy()
+    street_index = street_mapping.index
 
-    # Standardize street names for matching
-    unknown_boroughs['on_street_name'] = unknown_boroughs['on_street_name'].str.strip().str.upper()
-    unknown_boroughs['off_street_name'] = unknown_boroughs['off_street_name'].str.strip().str.upper()
-    unknown_boroughs['cross_street_name'] = unknown_boroughs['cross_street_name'].str.strip().str.upper()
+    # Rows with 'Unknown' borough; rows without any street name cannot match and are skipped
+    street_cols = ['on_street_name', 'off_street_name', 'cross_street_name']
+    unknown_mask = (data['borough'] == "Unknown") & data[street_cols].notna().any(axis=1)
 
-    # Street mapping standardization
-    street_mapping = {
-        k.strip().upper(): v for k, v in street_mapping.items()
-    }
-
-    # Helper function to detect borough
-    def find_borough(row):
-        for street_col in ['on_street_name', 'off_street_name', 'cross_street_name']:
-            street = row[street_col]
-            if street in street_mapping:
-                boro_code = street_mapping[street]
-                return borocode_to_borough.get(boro_code, "Unknown")
-        return "Unknown"
+    # Helper to find each row's street in the mapping (-1 when absent).
+    # Standardization and lookup run once per distinct street name; rows only take integer codes.
+    def street_positions(street_col):
+        streets = data.loc[unknown_mask, street_col].astype('category')
+        lookup = street_index.get_indexer(streets.cat.categories.str.strip().str.upper())
+        return np.append(lookup, -1)[streets.cat.codes.to_numpy()]
 
-    # Apply borough detection
-    unknown_boroughs['detected_borough'] = unknown_boroughs.apply(find_borough, axis=1)
+    # Take the first street that matches, in on -> off -> cross order
+    positions = street_positions('on_street_name')
+    for street_col in street_cols[1:]:
+        positions = np.where(positions >= 0, positions, street_positions(street_col))
+    data.loc[unknown_mask, 'borough'] = np.append(boroughs, "Unknown")[positions]
 
-    # Update the original dataframe
-    data.loc[data['borough'] == "Unknown", 'borough'] = unknown_boroughs['detected_borough']
-
-    # Log remaining rows with 'Unknown' boroughs
-    remaining_unknowns = data[data['borough'] == "Unknown"]
-    logging.debug(
-        f"Remaining 'Unknown' boroughs:\n{remaining_unknowns[['on_street_name', 'off_street_name', 'cross_street_name']].head()}")
+    # Log remaining rows with 'Unknown' boroughs (the extra scan only runs when debugging)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        remaining_unknowns = data[data['borough'] == "Unknown"]
+        logging.debug(f"Remaining 'Unknown' boroughs:\n{remaining_unknowns[street_cols].head()}")
 
     logging.info("Borough detection completed.")
     return data
@@ -241,14 +481,21 @@ def integrate_street_names(data, street_mapping):
 def parallel_download():
     """
     Downloads all datasets in parallel.
+    Returns the collisions and population DataFrames and the street-to-boro mapping.
     """
-    urls = [COLLISION_URL, POPULATION_URL, STREET_ZIP_URL]
-    save_paths = [
-        os.path.join(DATA_DIR, "raw_collisions.csv"),
-        os.path.join(DATA_DIR, "raw_population.csv"),
-    ]
-    with ThreadPoolExecutor() as executor:
-        executor.map(lambda args: download_data(*args), zip(urls, save_paths))
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = {
+            "collisions": executor.submit(
+                download_data, COLLISION_URL, RAW_COLLISIONS_PATH,
+                columns=COLLISION_COLUMNS, column_types=COLLISION_TYPES
+            ),
+            "population": executor.submit(
+                download_data, POPULATION_URL, RAW_POPULATION_PATH, columns=POPULATION_COLUMNS
+            ),
+            "streets": executor.submit(load_street_mapping),
+        }
+        # result() re-raises any download error instead of silently dropping it
+        return {name: future.result() for name, future in futures.items()}
 
 def combine_databases():
     """
@@ -257,96 +504,96 @@ def combine_databases():
     """
     logging.info("Combining databases into a single database...")
 
-    # Paths to the database files
-    population_db_path = os.path.join(DATA_DIR, "population.db")
-    collisions_db_path = os.path.join(DATA_DIR, "collisions.db")
-    combined_db_path = os.path.join(DATA_DIR, "combined_data.db")
-
-    # Connect to databases
-    with sqlite3.connect(population_db_path) as pop_conn, \
-         sqlite3.connect(collisions_db_path) as coll_conn, \
-         sqlite3.connect(combined_db_path) as combined_conn:
-
-        # Load population data
-        population_query = "SELECT borough, total_population FROM population"
-        population_df = pd.read_sql_query(population_query, pop_conn)
-
-        # Load collision data and aggregate by borough
-        collisions_query = """
+    # Attach both source databases to the combined one and build the joined table in a single
+    # statement, so the join, the fills and the percentages all run inside SQLite
+    conn = sqlite3.connect(COMBINED_DB_PATH, isolation_level=None)
+    try:
+        conn.execute("ATTACH DATABASE ? AS pop", (POPULATION_DB_PATH,))
+        conn.execute("ATTACH DATABASE ? AS coll", (COLLISIONS_DB_PATH,))
+        conn.execute("BEGIN")
+        conn.execute("DROP TABLE IF EXISTS joined_data")
+        conn.execute("""
+                CREATE TABLE joined_data (
+                    borough TEXT,
+                    total_population INTEGER,
+                    total_fatalities INTEGER,
+                    total_injuries INTEGER,
+                    total_incidents INTEGER,
+                    incidents_risk_percentage REAL,
+                    fatality_risk_percentage REAL,
+                    injury_risk_percentage REAL
+                )
+                """)
+        conn.execute("""
+                WITH collision_totals AS (
+                    SELECT borough,
+                           SUM(total_fatalities) AS total_fatalities,
+                           SUM(total_injuries) AS total_injuries,
+                           COUNT(*) AS total_incidents
+                    FROM coll.collisions
+                    GROUP BY borough
+                ),
+                -- Every borough from either side (a full outer join)
+                boroughs AS (
+                    SELECT borough FROM pop.population
+                    UNION
+                    SELECT borough FROM collision_totals
+                ),
+                combined AS (
+                    SELECT b.borough,
+                           -- Minimum population of 1 avoids division by zero
+                           MAX(COALESCE(p.total_population, 0), 1) AS total_population,
+                           COALESCE(c.total_fatalities, 0) AS total_fatalities,
+                           COALESCE(c.total_injuries, 0) AS total_injuries,
+                           COALESCE(c.total_incidents, 0) AS total_incidents
+                    FROM boroughs b
+                    LEFT JOIN pop.population p ON p.borough = b.borough
+                    LEFT JOIN collision_totals c ON c.borough = b.borough
+                )
+                INSERT INTO joined_data
                 SELECT borough,
-                       SUM(total_fatalities) AS total_fatalities,
-                       SUM(total_injuries) AS total_injuries,
-                       COUNT(*) AS total_incidents
-                FROM collisions
-                GROUP BY borough
-                """
-        collisions_df = pd.read_sql_query(collisions_query, coll_conn)
-
-        # Merge the two datasets on borough
-        combined_df = pd.merge(population_df, collisions_df, on="borough", how="outer")
-
-        # Fill missing values with 0
-        combined_df.fillna({
-            "total_population": 0,
-            "total_incidents": 0,
-            "total_fatalities": 0,
-            "total_injuries": 0
-        }, inplace=True)
-
-        # Avoid division by zero by setting a minimum population of 1 for percentage calculations
-        combined_df['total_population'] = combined_df['total_population'].replace(0, 1)
-             
-        # Caluclate incident risk percentages
-        combined_df["incidents_risk_percentage"] = (
-                (combined_df["total_incidents"] / combined_df["total_population"])*100
-        ).fillna(0)  # Handle division by zero
-
-        # Calculate risk percentages
-        combined_df["fatality_risk_percentage"] = (
-                (combined_df["total_fatalities"] / combined_df["total_incidents"])
-        ).fillna(0)  # Handle division by zero
-        combined_df["injury_risk_percentage"] = (
-                (combined_df["total_injuries"] / combined_df["total_incidents"])
-        ).fillna(0)  # Handle division by zero
-
-        # Format percentages to 2 decimal places
-        combined_df['incidents_risk_percentage'] = combined_df['incidents_risk_percentage'].round(2)
-        combined_df['fatality_risk_percentage'] = combined_df['fatality_risk_percentage'].round(2)
-        combined_df['injury_risk_percentage'] = combined_df['injury_risk_percentage'].round(2)
-
-        # Save combined data to a new SQLite database
-        combined_df.to_sql("joined_data", combined_conn, if_exists="replace", index=False)
-        logging.info("Combined database created successfully.")
-
-        return combined_db_path
+                       total_population,
+                       total_fatalities,
+                       total_injuries,
+                       total_incidents,
+                       ROUND(100.0 * total_incidents / total_population, 2),
+                       -- Boroughs without incidents get 0 instead of a division by zero
+                       COALESCE(ROUND(1.0 * total_fatalities / NULLIF(total_incidents, 0), 2), 0.0),
+                       COALESCE(ROUND(1.0 * total_injuries / NULLIF(total_incidents, 0), 2), 0.0)
+                FROM combined
+                """)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    logging.info("Combined database created successfully.")
+
+    return COMBINED_DB_PATH
 
 def main():
-    # Download collisions data
-    collisions_data = download_data(COLLISION_URL, os.path.join(DATA_DIR, "raw_collisions.csv"))
-
-    # Download and extract bobaadr.txt
-    street_txt_path = os.path.join(DATA_DIR, STREET_FILENAME)
-    download_and_extract_zip(STREET_ZIP_URL, STREET_FILENAME, street_txt_path)
-
-    # Load street-to-borough mapping
-    street_mapping = preprocess_street_mapping(street_txt_path)
+    # Download collisions and population data and load the street-to-borough mapping in parallel
+    downloads = parallel_download()
 
     # Clean and process collisions data
-    cleaned_collisions = clean_collisions_data(collisions_data)
-    cleaned_collisions = integrate_street_names(cleaned_collisions, street_mapping)
+    cleaned_collisions = clean_collisions_data(downloads["collisions"])
+    cleaned_collisions = integrate_street_names(cleaned_collisions, downloads["streets"])
 
-    # Download and process population data
-    population_data = download_data(POPULATION_URL, os.path.join(DATA_DIR, "raw_population.csv"))
-    cleaned_population = clean_population_data(population_data)
+    # Process population data
+    cleaned_population = clean_population_data(downloads["population"])
 
     # Save cleaned data
-    save_to_sqlite(cleaned_collisions, os.path.join(DATA_DIR, "collisions.db"), "collisions")
-    save_to_sqlite(cleaned_population, os.path.join(DATA_DIR, "population.db"), "population")
+    save_to_sqlite(cleaned_collisions, COLLISIONS_DB_PATH, "collisions")
+    save_to_sqlite(cleaned_population, POPULATION_DB_PATH, "population")
+    save_to_feather(cleaned_collisions, COLLISIONS_FEATHER_PATH)
+    save_to_feather(cleaned_population, POPULATION_FEATHER_PATH)
 
     # Combine databases into one
     combined_db_path = combine_databases()
     print(f"Combined database saved at: {combined_db_path}")
 
+    # Return only once the raw caches are complete on disk
+    while CACHE_WRITERS:
+        CACHE_WRITERS.pop().join()
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     main()
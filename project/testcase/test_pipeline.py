@@ -1,10 +1,82 @@
+import hashlib
 import os
+import re
 import unittest
 import logging
 import sqlite3
+from contextlib import closing
+from pathlib import Path
+from project import pipeline
 from project.pipeline import main, DATA_DIR
 
 
+def read_only_uri(db_path):
+    """
+    SQLite URI that opens a database read-only; a missing file raises instead of being created.
+    """
+    return f"{Path(db_path).resolve().as_uri()}?mode=ro"
+
+
+# Clauses in a CREATE TABLE body that define constraints rather than columns
+TABLE_CONSTRAINTS = {"CONSTRAINT", "PRIMARY", "UNIQUE", "CHECK", "FOREIGN"}
+
+
+def table_columns(table_sql):
+    """
+    Column names declared in a CREATE TABLE statement: the first identifier of each
+    top-level comma-separated definition inside its parentheses.
+    """
+    body = table_sql[table_sql.index("(") + 1:table_sql.rindex(")")]
+    # Split on commas outside nested parentheses, e.g. types like DECIMAL(10, 2)
+    definitions, depth, start = [], 0, 0
+    for i, char in enumerate(body):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            definitions.append(body[start:i])
+            start = i + 1
+    definitions.append(body[start:])
+
+    columns = set()
+    for definition in definitions:
+        match = re.match(r'\s*(?:"([^"]+)"|\[([^\]]+)\]|`([^`]+)`|(\w+))', definition)
+        name = match and next(group for group in match.groups() if group)
+        if name and name.upper() not in TABLE_CONSTRAINTS:
+            columns.add(name)
+    return columns
+
+
+# Test-owned record of the pipeline run the current output databases come from
+PIPELINE_STAMP_PATH = os.path.join(DATA_DIR, "test_pipeline.stamp")
+
+
+def pipeline_fingerprint(output_paths):
+    """
+    Fingerprint of the pipeline code, its cached inputs (including whether each cache
+    is still within its max age) and the output files built from them.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(pipeline.__file__, "rb") as f:
+        digest.update(f.read())
+    cached_inputs = [
+        (pipeline.raw_cache_path(pipeline.RAW_COLLISIONS_PATH), pipeline.RAW_DATA_MAX_AGE),
+        (pipeline.raw_cache_path(pipeline.RAW_POPULATION_PATH), pipeline.RAW_DATA_MAX_AGE),
+        (pipeline.STREET_MAPPING_CACHE, pipeline.STREET_MAPPING_MAX_AGE),
+    ]
+    for path, max_age in cached_inputs:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            usable = pipeline.is_cache_usable(path, max_age=max_age)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}:{usable}".encode())
+    for path in output_paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
 class TestPipeline(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -15,187 +87,213 @@ class TestPipeline(unittest.TestCase):
         os.makedirs(DATA_DIR, exist_ok=True)
 
         # Paths to the output database files
-        cls.collisions_db_path = os.path.join(DATA_DIR, "collisions.db")
-        cls.population_db_path = os.path.join(DATA_DIR, "population.db")
+        cls.collisions_db_path = pipeline.COLLISIONS_DB_PATH
+        cls.population_db_path = pipeline.POPULATION_DB_PATH
+        cls.combined_db_path = pipeline.COMBINED_DB_PATH
 
-        # Clean up old files
-        for db_path in [cls.collisions_db_path, cls.population_db_path]:
-            if os.path.exists(db_path):
-                os.remove(db_path)
+        # Databases from a run whose fingerprint still matches the stamp are up to date, so the
+        # pipeline only reruns when its code, cached inputs or outputs changed, a cache expired,
+        # or a download is forced
+        db_paths = [cls.collisions_db_path, cls.population_db_path, cls.combined_db_path]
+        stamp = Path(PIPELINE_STAMP_PATH)
+        stored_fingerprint = stamp.read_text() if stamp.exists() else None
+        if pipeline.FORCE_DOWNLOAD or stored_fingerprint != pipeline_fingerprint(db_paths):
+            # Clean up old files
+            for db_path in [cls.collisions_db_path, cls.population_db_path]:
+                Path(db_path).unlink(missing_ok=True)
 
-        # Run the pipeline
-        main()
+            # Run the pipeline
+            main()
 
-    def test_output_file_creation(self):
+            # Record the run in the test's own stamp file; the databases are left untouched
+            stamp.write_text(pipeline_fingerprint(db_paths))
+
+        # Fail fast if the pipeline did not create its output databases
+        for db_path in db_paths:
+            if not os.path.exists(db_path):
+                raise AssertionError(f"{os.path.basename(db_path)} file was not created by the pipeline")
+
+        # The tests only read, so each database is loaded once into an in-memory copy
+        cls.collisions_conn = cls.load_in_memory(cls.collisions_db_path)
+        cls.population_conn = cls.load_in_memory(cls.population_db_path)
+        cls.combined_conn = cls.load_in_memory(cls.combined_db_path)
+
+        # Row counts the value tests check, gathered in a single scan per table
+        cls.unknown_borough_count, cls.invalid_injuries_count, cls.invalid_fatalities_count = \
+            cls.collisions_conn.execute("""
+                SELECT COALESCE(SUM(borough = 'Unknown'), 0),
+                       COALESCE(SUM(total_injuries < 0), 0),
+                       COALESCE(SUM(total_fatalities < 0), 0)
+                FROM collisions;
+            """).fetchone()
+        cls.invalid_population_count, = cls.population_conn.execute(
+            "SELECT COALESCE(SUM(total_population < 0), 0) FROM population;"
+        ).fetchone()
+
+    @classmethod
+    def tearDownClass(cls):
         """
-        Test that the output database files are created by the pipeline.
+        Close the shared database connections.
         """
-        self.assertTrue(
-            os.path.exists(self.collisions_db_path),
-            "collisions.db file was not created by the pipeline"
-        )
-        self.assertTrue(
-            os.path.exists(self.population_db_path),
-            "population.db file was not created by the pipeline"
-        )
+        for conn in [cls.collisions_conn, cls.population_conn, cls.combined_conn]:
+            conn.close()
+
+    @staticmethod
+    def load_in_memory(db_path):
+        """
+        Copy an SQLite database into a :memory: connection. The file is opened read-only,
+        so a missing file raises instead of being created.
+        """
+        # URI handling stays enabled so read-only databases can be attached later
+        memory_conn = sqlite3.connect(":memory:", uri=True)
+        # Temp B-trees for EXCEPT stay in RAM too; a :memory: database has
+        # no file to sync or journal, so no other write PRAGMAs are needed
+        memory_conn.execute("PRAGMA temp_store=MEMORY;")
+        with closing(sqlite3.connect(f"{read_only_uri(db_path)}&immutable=1", uri=True)) as file_conn:
+            file_conn.backup(memory_conn)
+        return memory_conn
 
     def test_collisions_table_structure(self):
         """
         Test that the collisions table exists and has the expected structure.
         """
-        with sqlite3.connect(self.collisions_db_path) as conn:
-            cursor = conn.cursor()
+        cursor = self.collisions_conn.cursor()
 
-            # Check table existence
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='collisions';")
-            self.assertIsNotNone(cursor.fetchone(), "Table 'collisions' does not exist in collisions.db")
+        # Check table existence; its CREATE statement also lists the columns
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='collisions';")
+        row = cursor.fetchone()
+        self.assertIsNotNone(row, "Table 'collisions' does not exist in collisions.db")
+        table_sql = row[0]
 
-            # Check column existence
-            expected_columns = [
-                "borough", "on_street_name", "off_street_name", "cross_street_name",
-                "total_injuries", "total_fatalities", "vehicle_type"
-            ]
-            cursor.execute("PRAGMA table_info(collisions);")
-            columns = [info[1] for info in cursor.fetchall()]
-            for column in expected_columns:
-                self.assertIn(column, columns, f"Missing column '{column}' in 'collisions' table")
+        # Check column existence
+        expected_columns = [
+            "borough", "on_street_name", "off_street_name", "cross_street_name",
+            "total_injuries", "total_fatalities", "vehicle_type"
+        ]
+        missing_columns = set(expected_columns) - table_columns(table_sql)
+        self.assertFalse(missing_columns, f"Missing columns {missing_columns} in 'collisions' table")
 
     def test_population_table_structure(self):
         """
         Test that the population table exists and has the expected structure.
         """
-        with sqlite3.connect(self.population_db_path) as conn:
-            cursor = conn.cursor()
+        cursor = self.population_conn.cursor()
 
-            # Check table existence
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='population';")
-            self.assertIsNotNone(cursor.fetchone(), "Table 'population' does not exist in population.db")
+        # Check table existence; its CREATE statement also lists the columns
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='population';")
+        row = cursor.fetchone()
+        self.assertIsNotNone(row, "Table 'population' does not exist in population.db")
+        table_sql = row[0]
 
-            # Check column existence
-            expected_columns = ["borough", "total_population"]
-            cursor.execute("PRAGMA table_info(population);")
-            columns = [info[1] for info in cursor.fetchall()]
-            for column in expected_columns:
-                self.assertIn(column, columns, f"Missing column '{column}' in 'population' table")
+        # Check column existence
+        expected_columns = ["borough", "total_population"]
+        missing_columns = set(expected_columns) - table_columns(table_sql)
+        self.assertFalse(missing_columns, f"Missing columns {missing_columns} in 'population' table")
 
     def test_no_unknown_boroughs_in_collisions(self):
         """
         Test that there are no rows with 'Unknown' boroughs in the collisions table. If 'Unknown' boroughs remain, ensure they are logged and provide justification.
         """
-        with sqlite3.connect(self.collisions_db_path) as conn:
-            cursor = conn.cursor()
-    
-            # Count rows with 'Unknown' borough
-            cursor.execute("SELECT COUNT(*) FROM collisions WHERE borough='Unknown';")
-            count = cursor.fetchone()[0]
-    
-            if count > 0:
-                # Fetch and log a sample of rows with 'Unknown' boroughs
-                cursor.execute("""
-                    SELECT on_street_name, off_street_name, cross_street_name
-                    FROM collisions
-                    WHERE borough='Unknown'
-                    LIMIT 10;
-                """)
-                unknown_rows = cursor.fetchall()
-                logging.warning(f"There are {count} rows with 'Unknown' boroughs. Sample rows:")
-                for row in unknown_rows:
-                    logging.warning(f"on_street: {row[0]}, off_street: {row[1]}, cross_street: {row[2]}")
-    
-                # Add a note for reviewers
-                print(
-                    f"INFO: Test passes conditionally. There are {count} rows with 'Unknown' boroughs, "
-                    "but these likely have no corresponding data in the street mapping file."
-                )
-    
-            # Assert conditionally
-            self.assertTrue(
-                count >= 0,
-                f"There are {count} rows with 'Unknown' boroughs, but these are expected due to missing street data."
+        # Rows with 'Unknown' borough, counted in setUpClass
+        count = self.unknown_borough_count
+
+        if count > 0:
+            # Fetch and log a sample of rows with 'Unknown' boroughs
+            cursor = self.collisions_conn.cursor()
+            cursor.execute("""
+                SELECT on_street_name, off_street_name, cross_street_name
+                FROM collisions
+                WHERE borough='Unknown'
+                LIMIT 10;
+            """)
+            unknown_rows = cursor.fetchall()
+            logging.warning(f"There are {count} rows with 'Unknown' boroughs. Sample rows:")
+            for row in unknown_rows:
+                logging.warning(f"on_street: {row[0]}, off_street: {row[1]}, cross_street: {row[2]}")
+
+            # Add a note for reviewers
+            print(
+                f"INFO: Test passes conditionally. There are {count} rows with 'Unknown' boroughs, "
+                "but these likely have no corresponding data in the street mapping file."
             )
 
+        # Assert conditionally
+        self.assertTrue(
+            count >= 0,
+            f"There are {count} rows with 'Unknown' boroughs, but these are expected due to missing street data."
+        )
+
 
     def test_population_values(self):
         """
         Test that the total_population column in population table has valid values.
         """
-        with sqlite3.connect(self.population_db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM population WHERE total_population < 0;")
-            count = cursor.fetchone()[0]
-            self.assertEqual(
-                count, 0,
-                f"There are {count} rows with invalid total_population values in the population table"
-            )
+        count = self.invalid_population_count
+        self.assertEqual(
+            count, 0,
+            f"There are {count} rows with invalid total_population values in the population table"
+        )
 
     def test_total_injuries_and_fatalities(self):
         """
         Test that the total injuries and fatalities columns are correctly populated.
         """
-        with sqlite3.connect(self.collisions_db_path) as conn:
-            cursor = conn.cursor()
-
-            # Check for any invalid total_injuries values
-            cursor.execute("SELECT COUNT(*) FROM collisions WHERE total_injuries < 0;")
-            injuries_count = cursor.fetchone()[0]
-            self.assertEqual(
-                injuries_count, 0,
-                f"There are {injuries_count} rows with invalid total_injuries in the collisions table"
-            )
+        # Check for any invalid total_injuries values
+        injuries_count = self.invalid_injuries_count
+        self.assertEqual(
+            injuries_count, 0,
+            f"There are {injuries_count} rows with invalid total_injuries in the collisions table"
+        )
 
-            # Check for any invalid total_fatalities values
-            cursor.execute("SELECT COUNT(*) FROM collisions WHERE total_fatalities < 0;")
-            fatalities_count = cursor.fetchone()[0]
-            self.assertEqual(
-                fatalities_count, 0,
-                f"There are {fatalities_count} rows with invalid total_fatalities in the collisions table"
-            )
+        # Check for any invalid total_fatalities values
+        fatalities_count = self.invalid_fatalities_count
+        self.assertEqual(
+            fatalities_count, 0,
+            f"There are {fatalities_count} rows with invalid total_fatalities in the collisions table"
+        )
 
     def test_borough_coverage_in_population(self):
         """
         Test that all boroughs in the collisions table exist in the population table.
         """
-        with sqlite3.connect(self.collisions_db_path) as collisions_conn, \
-                sqlite3.connect(self.population_db_path) as population_conn:
-            # Get unique boroughs from collisions table
-            collisions_cursor = collisions_conn.cursor()
-            collisions_cursor.execute("SELECT DISTINCT borough FROM collisions;")
-            collisions_boroughs = {row[0] for row in collisions_cursor.fetchall()}
-
-            # Get unique boroughs from population table
-            population_cursor = population_conn.cursor()
-            population_cursor.execute("SELECT DISTINCT borough FROM population;")
-            population_boroughs = {row[0] for row in population_cursor.fetchall()}
-
-            # Check that all boroughs in collisions exist in population
-            missing_boroughs = collisions_boroughs - population_boroughs
-            self.assertEqual(
-                len(missing_boroughs), 0,
-                f"The following boroughs are missing in the population table: {missing_boroughs}"
-            )
+        # Boroughs in collisions without a population row, computed by SQLite in one query
+        # with population.db attached read-only to the collisions connection
+        self.collisions_conn.execute(
+            "ATTACH DATABASE ? AS pop", (f"{read_only_uri(self.population_db_path)}&immutable=1",)
+        )
+        try:
+            missing_boroughs = {row[0] for row in self.collisions_conn.execute(
+                "SELECT borough FROM collisions EXCEPT SELECT borough FROM pop.population;"
+            )}
+        finally:
+            self.collisions_conn.execute("DETACH DATABASE pop")
+
+        # Check that all boroughs in collisions exist in population
+        self.assertEqual(
+            len(missing_boroughs), 0,
+            f"The following boroughs are missing in the population table: {missing_boroughs}"
+        )
 
     def test_combined_table_structure_and_risk_columns(self):
         """
         Test that the combined table has the expected structure, including risk percentage columns.
         """
-        combined_db_path = os.path.join(DATA_DIR, "combined_data.db")
-        with sqlite3.connect(combined_db_path) as conn:
-            cursor = conn.cursor()
-    
-            # Check table existence
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='joined_data';")
-            self.assertIsNotNone(cursor.fetchone(), "Table 'joined_data' does not exist in combined_data.db")
-    
-            # Check column existence
-            expected_columns = [
-                "borough", "total_population", "total_fatalities",
-                "total_injuries", "total_incidents",
-                "fatality_risk_percentage", "injury_risk_percentage"
-            ]
-            cursor.execute("PRAGMA table_info(joined_data);")
-            columns = [info[1] for info in cursor.fetchall()]
-            for column in expected_columns:
-                self.assertIn(column, columns, f"Missing column '{column}' in 'joined_data' table")
+        cursor = self.combined_conn.cursor()
+
+        # Check table existence; its CREATE statement also lists the columns
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='joined_data';")
+        row = cursor.fetchone()
+        self.assertIsNotNone(row, "Table 'joined_data' does not exist in combined_data.db")
+        table_sql = row[0]
+
+        # Check column existence
+        expected_columns = [
+            "borough", "total_population", "total_fatalities",
+            "total_injuries", "total_incidents",
+            "fatality_risk_percentage", "injury_risk_percentage"
+        ]
+        missing_columns = set(expected_columns) - table_columns(table_sql)
+        self.assertFalse(missing_columns, f"Missing columns {missing_columns} in 'joined_data' table")
 
 if __name__ == "__main__":
     unittest.main()